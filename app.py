@@ -1,6 +1,6 @@
 # Libraries
 from dash import dcc, html, Dash
-from dash.dependencies import Output, Input
+from dash.dependencies import Output, Input, State, ALL
 import dash_bootstrap_components as dbc
 import feffery_markdown_components as fmc
 
@@ -8,10 +8,19 @@ from utils.app_setup import (
     YEAR_PLACE_OPTIONS,
     PLACE_YEAR_OPTIONS,
     DEMOGRAPHICS_OPTIONS,
+    HOVER_TITLES,
+    DOLLAR_YEAR_OPTIONS,
+    CPI_INDEX,
     ALL_YEARS,
+    DATA_URL,
+    TELEMETRY_URL,
+    EXPORT_URL,
+    BOUNDARY_VINTAGES,
     footer_string,
     geodata_map, geodata_plot
 )
+from utils.data_api import api
+from utils.telemetry import telemetry
 
 
 # -- -- --
@@ -34,9 +43,13 @@ CherryRed_color = '#E3242B'
 # -- --
 app = Dash(__name__,
            external_stylesheets = [dbc.themes.SIMPLEX, "assets/style.css"],
-           meta_tags = [{"name": "viewport", "content": "width=device-width, initial-scale=1"}]
+           assets_path_ignore = ['workers'], # Web Worker scripts, loaded by assets/place_data.js
+           meta_tags = [{"name": "viewport", "content": "width=device-width, initial-scale=1"},
+                        {"name": "telemetry-url", "content": TELEMETRY_URL}] # Read by assets/telemetry.js
            )
 server = app.server
+server.register_blueprint(api)
+server.register_blueprint(telemetry)
 app.title = 'Median Household Income in Los Angeles County'
 
 
@@ -55,7 +68,7 @@ app.layout = dbc.Container([
                }),
     
     # Subtitle
-    html.Div([html.P(f"Median Household Income (in {max(ALL_YEARS)} Consumer Price Index Adjusted Dollars) for Census Tracts across Cities and Census-Designated Places in Los Angeles County, {min(ALL_YEARS)} to {max(ALL_YEARS)}")],
+    html.Div([html.P(["Median Household Income (in ", html.Span(id = 'dollar-year-title', children = max(ALL_YEARS)), f" Consumer Price Index Adjusted Dollars) for Census Tracts across Cities and Census-Designated Places in Los Angeles County, {min(ALL_YEARS)} to {max(ALL_YEARS)}"])],
              style = {'display': 'block',
                 'color': ObsidianBlack_color,
                 'margin': '-0.5em 0',
@@ -106,7 +119,17 @@ app.layout = dbc.Container([
                          clearable   = False,
                          searchable  = False
                         )],
-            width = 12, sm = 12, xl = 5,
+            width = 12, sm = 12, xl = 4,
+            style = {'margin': '0 0', 'padding': '30px 1.25% 0px 1.25%'}),
+        dbc.Col([
+            dcc.Dropdown(id          = 'dollar-year-dropdown',
+                         placeholder = 'Dollars',
+                         options     = DOLLAR_YEAR_OPTIONS,
+                         value       = max(ALL_YEARS),
+                         clearable   = False,
+                         searchable  = False
+                        )],
+            width = 12, sm = 12, xl = 1,
             style = {'margin': '0 0', 'padding': '30px 1.25% 0px 1.25%'}),
         dbc.Col([
             dcc.Dropdown(id          = 'census-tract-dropdown',
@@ -115,7 +138,24 @@ app.layout = dbc.Container([
                         )],
             width = 12, sm = 12, xl = 3,
             style = {'margin': '0 0', 'padding': '30px 1.25% 0px 1.25%'}),
-        ], align = 'center', justify = 'center')
+        ], align = 'center', justify = 'center'),
+
+        # County-wide search of places, census tracts and GEO_IDs (selects the place, year and census tract)
+        dbc.Row([
+        dbc.Col([
+            dcc.Input(id          = 'search-input',
+                      type        = 'search',
+                      placeholder = 'Search a place, census tract or GEO_ID (e.g. Census Tract 5751)',
+                      debounce    = False,
+                      autoComplete = 'off',
+                      className   = 'form-control'),
+            html.Div(id        = 'search-results',
+                     className = 'list-group',
+                     style     = {'position': 'absolute', 'z-index': 1000, 'width': '97.5%'})
+            ],
+            width = 12, xl = 6,
+            style = {'position': 'relative', 'margin': '0 0', 'padding': '15px 1.25% 0px 1.25%'}),
+        ], justify = 'center')
     ], style = {'padding': '0px 2.00% 10px 2.00%'}),
     
     # Map and plot
@@ -126,6 +166,30 @@ app.layout = dbc.Container([
                     dbc.CardHeader(children = [html.B("Median Household Income"), " for ", html.B(id="map-title1"), " in ", html.B(id="map-title2"), " by Census Tract, ", html.B(id="map-title3")],
                                    style    = {'background-color': MaroonRed_color, 'color': '#FFFFFF'}),
                     dbc.CardBody([
+                        dbc.RadioItems(id      = 'map-mode',
+                                       options = [{'label': 'Income', 'value': 'level'},
+                                                  {'label': f'Change to {max(ALL_YEARS)}', 'value': 'latest'},
+                                                  {'label': 'Change from the previous year', 'value': 'yoy'},
+                                                  {'label': 'Play all years', 'value': 'playback'}],
+                                       value   = 'level',
+                                       inline  = True,
+                                       style   = {'color': ObsidianBlack_color, 'font-family': 'Trebuchet MS, sans-serif'}),
+                        dbc.Switch(id    = 'quantile-colorscale-switch',
+                                   label = 'Color by county quantiles',
+                                   value = False,
+                                   style = {'color': ObsidianBlack_color, 'font-family': 'Trebuchet MS, sans-serif'}),
+                        dbc.Switch(id    = 'change-percent-switch',
+                                   label = 'Percent change',
+                                   value = False,
+                                   style = {'color': ObsidianBlack_color, 'font-family': 'Trebuchet MS, sans-serif'}),
+                        # Download of the current view (place, year and demographic) from the export API
+                        *([dbc.DropdownMenu(id       = 'download-menu',
+                                            label    = 'Download',
+                                            size     = 'sm',
+                                            color    = 'secondary',
+                                            children = [dbc.DropdownMenuItem(label, id = f'download-{export_format}', external_link = True)
+                                                        for label, export_format in [('CSV', 'csv'), ('NDJSON', 'ndjson'), ('Parquet', 'parquet')]],
+                                            style    = {'font-family': 'Trebuchet MS, sans-serif', 'margin': '5px 0'})] if EXPORT_URL else []),
                         dcc.Loading(color   = '#29B0F0',
                                     display = 'show',
                                     style   = {'position': 'relative', 'margin-top': '75%'}),
@@ -154,11 +218,20 @@ app.layout = dbc.Container([
     ]),
 
     # Data
-    dcc.Store( id = 'MASTERFILE' ),
+    dcc.Store( id = 'PLACE_INDEX' ),
     dcc.Store( id = 'LAT-LON' ),
+    dcc.Store( id = 'FIGURE_MANIFEST' ),
+    dcc.Store( id = 'COUNTY_DISTRIBUTIONS' ),
+    dcc.Store( id = 'SEARCH_INDEX' ),
+    dcc.Store( id = 'SEARCH_RESULTS' ),
+    dcc.Store( id = 'DATA_URL',             data = DATA_URL ),
+    dcc.Store( id = 'EXPORT_URL',           data = EXPORT_URL ),
+    dcc.Store( id = 'CPI_INDEX',            data = CPI_INDEX ),
     dcc.Store( id = 'YEAR_PLACE_OPTIONS',   data = YEAR_PLACE_OPTIONS ),
     dcc.Store( id = 'PLACE_YEAR_OPTIONS',   data = PLACE_YEAR_OPTIONS ),
-    dcc.Store( id = 'DEMOGRAPHICS_OPTIONS', data = DEMOGRAPHICS_OPTIONS )
+    dcc.Store( id = 'BOUNDARY_VINTAGES',    data = BOUNDARY_VINTAGES ),
+    dcc.Store( id = 'DEMOGRAPHICS_OPTIONS', data = DEMOGRAPHICS_OPTIONS ),
+    dcc.Store( id = 'HOVER_TITLES',         data = HOVER_TITLES )
 
 ], style = {'background-color': LightBrown_color, "padding": "0px 0px 20px 0px"})
 
@@ -167,22 +240,33 @@ app.layout = dbc.Container([
 # ------------ CALLBACKS ------------ #
 #
 # Data:
-#  place value -> masterfile data
+#  place value, year value -> place index (census tracts of the year; loaded year first in a Web Worker, see assets/place_data.js)
 #  year value -> lat/lon center point data
+#  place value -> precomputed figure manifest
+#  data url -> county-wide distributions
+#  data url -> search index
 #
 # Dropdowns:
 #  place value -> year options
 #  year options -> default year value
 #  place options, year options, map ClickData -> census tract options
 #  click data -> census tract value
+#  search text -> search results; search result click -> place, year and census tract values
 #
 # Titles:
 #  place value, year value, demographic value -> map title
 #  place value, census tract value -> plot title
+#  dollar year value -> subtitle
+#
+# Downloads:
+#  place value, year value, demographic value, dollar year value -> download links of the current view
 #
 # Graphs:
-#  place value, year value, census tract value, demographic value -> map
-#  place value, census tract value, demographic value -> plot
+#  place value, year value, census tract value, demographic value, quantile switch, dollar year value,
+#  map mode, percent change switch -> map (income, or its change to the most recent/from the previous year, or
+#  all years of the place as animation frames)
+#  place value, year value, census tract value, demographic value, dollar year value -> plot
+#  (precomputed figures are used when available; see assets/figure_cache.js)
 #
 # ----------------------------------- #
 
@@ -190,32 +274,85 @@ app.layout = dbc.Container([
 # Data
 # -- -- -- --
 
-# Masterfile
+# Place index: the place name and the census tracts (label -> GEO_ID) of the selected year. The place data
+# worker fetches, parses and indexes the selected year's masterfile first (for the map), then streams in the
+# place's tract series (for the plot) and its other years (for year switches) in the background.
 app.clientside_callback(
     """
-    async function(selected_place) {
-        const url = `https://raw.githubusercontent.com/ramindersinghdubb/Median-Household-Income-in-LA-County/refs/heads/main/data/masterfiles/${selected_place}_masterfile.json`;
+    async function(selected_place, selected_year, DATA_URL, PLACE_YEAR_OPTIONS) {
+        const years = (PLACE_YEAR_OPTIONS[selected_place] ?? []).filter(option => !option['disabled']).map(option => option['value']);
+        if (!years.includes(selected_year)) {
+            return window.dash_clientside.no_update;
+        }
+        const sample = window.telemetry.start('place_index', selected_place, selected_year);
+        const place_index = await window.place_data.request('place_index', {
+            'base': window.place_data.url(DATA_URL, 'masterfiles/'), 'place': selected_place, 'year': selected_year, 'years': years
+        }, sample);
+        window.telemetry.end(sample);
+        return place_index;
+    }
+    """,
+    Output('PLACE_INDEX', 'data'),
+    [Input('place-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
+     Input('DATA_URL', 'data'),
+     Input('PLACE_YEAR_OPTIONS', 'data')
+    ]
+)
+
+# Latitudinal/longitudinal center points
+app.clientside_callback(
+    """
+    async function(selected_year, DATA_URL) {
+        const url = `${DATA_URL}lat_lon_center_points/${selected_year}_latlon_center_points.json`;
         const response = await fetch(url);
         const data = await response.json();
         return data;
     }
     """,
-    Output('MASTERFILE', 'data'),
-    Input('place-dropdown', 'value')
+    Output('LAT-LON', 'data'),
+    [Input('year-dropdown', 'value'),
+     Input('DATA_URL', 'data')
+    ]
 )
 
-# Latitudinal/longitudinal center points
+# County-wide distributions (quantiles, histograms and quantile colorscales by year and demographic)
 app.clientside_callback(
     """
-    async function(selected_year) {
-        const url = `https://raw.githubusercontent.com/ramindersinghdubb/Median-Household-Income-in-LA-County/refs/heads/main/data/lat_lon_center_points/${selected_year}_latlon_center_points.json`;
+    async function(DATA_URL) {
+        const url = `${DATA_URL}county_distributions.json`;
         const response = await fetch(url);
         const data = await response.json();
         return data;
     }
     """,
-    Output('LAT-LON', 'data'),
-    Input('year-dropdown', 'value')
+    Output('COUNTY_DISTRIBUTIONS', 'data'),
+    Input('DATA_URL', 'data')
+)
+
+# County-wide search index of places, census tracts and GEO_IDs
+app.clientside_callback(
+    """
+    async function(DATA_URL) {
+        const url = `${DATA_URL}search_index.json`;
+        const response = await fetch(url);
+        const data = await response.json();
+        return data;
+    }
+    """,
+    Output('SEARCH_INDEX', 'data'),
+    Input('DATA_URL', 'data')
+)
+
+# Precomputed figure manifest (static deployment only)
+app.clientside_callback(
+    """
+    async function(selected_place) {
+        return await window.figure_cache.fetch_manifest(selected_place);
+    }
+    """,
+    Output('FIGURE_MANIFEST', 'data'),
+    Input('place-dropdown', 'value')
 )
 
 
@@ -252,16 +389,14 @@ app.clientside_callback(
 # Census tract options
 app.clientside_callback(
     """
-    function(selected_place, selected_year, MASTERFILE) {
-        var options = MASTERFILE.filter(x => x['YEAR'] === selected_year);
-        var tract_options = options.map(item => { return item.TRACT });
-        return tract_options
+    function(selected_place, selected_year, PLACE_INDEX) {
+        return Object.keys(PLACE_INDEX['GEO_IDS'][selected_year] ?? {});
     }
     """,
     Output('census-tract-dropdown', 'options'),
     [Input('place-dropdown', 'value'),
      Input('year-dropdown', 'value'),
-     Input('MASTERFILE', 'data')
+     Input('PLACE_INDEX', 'data')
     ]
 )
 
@@ -269,13 +404,57 @@ app.clientside_callback(
 app.clientside_callback(
     """
     function(clickData) {
-        return clickData['points']['0']['customdata']
+        return clickData['points']['0']['customdata'][0]
     }
     """,
     Output('census-tract-dropdown', 'value'),
     Input('chloropleth_map', 'clickData')
 )
 
+# Search results (type-ahead, see assets/search.js)
+app.clientside_callback(
+    """
+    function(search_text, SEARCH_INDEX) {
+        const results = window.tract_search.search(SEARCH_INDEX, search_text ?? '', 8);
+        const items = results.map((result, idx) => ({
+            'namespace': 'dash_html_components', 'type': 'Button',
+            'props': {'id': {'type': 'search-result', 'index': idx}, 'n_clicks': 0,
+                      'className': 'list-group-item list-group-item-action',
+                      'children': result['TRACT'] == null ? `${result['CITY']}` : `${result['TRACT']}, ${result['CITY']} (${result['YEAR']})`}
+        }));
+        return [items, results];
+    }
+    """,
+    [Output('search-results', 'children'),
+     Output('SEARCH_RESULTS', 'data')
+    ],
+    [Input('search-input', 'value'),
+     Input('SEARCH_INDEX', 'data')
+    ]
+)
+
+# Place, year and census tract values of the clicked search result
+app.clientside_callback(
+    """
+    function(n_clicks, SEARCH_RESULTS) {
+        const triggered = window.dash_clientside.callback_context.triggered_id;
+        if (triggered == undefined || !n_clicks[triggered['index']]) {
+            return window.dash_clientside.no_update;
+        }
+        const result = SEARCH_RESULTS[triggered['index']];
+        return [result['ABBREV_NAME'], result['YEAR'], result['TRACT'], ''];
+    }
+    """,
+    [Output('place-dropdown', 'value'),
+     Output('year-dropdown', 'value'),
+     Output('census-tract-dropdown', 'value', allow_duplicate = True),
+     Output('search-input', 'value')
+    ],
+    Input({'type': 'search-result', 'index': ALL}, 'n_clicks'),
+    State('SEARCH_RESULTS', 'data'),
+    prevent_initial_call = True
+)
+
 
 # -- -- -- --
 # Titles
@@ -284,10 +463,8 @@ app.clientside_callback(
 # Map title
 app.clientside_callback(
     """
-    function(selected_demographic, selected_year, DEMOGRAPHICS_OPTIONS, MASTERFILE) {
-        var my_array = MASTERFILE.filter(item => item['YEAR'] === selected_year);
-        var city_array = my_array.map(({CITY}) => CITY);
-        var selected_city = city_array[0];
+    function(selected_demographic, selected_year, DEMOGRAPHICS_OPTIONS, PLACE_INDEX) {
+        var selected_city = PLACE_INDEX['GEO_IDS'][selected_year] != undefined ? PLACE_INDEX['CITY'] : undefined;
 
         var demographic = DEMOGRAPHICS_OPTIONS.filter(item => item['value'] == selected_demographic);
         var demographic = demographic[0]['label']['props']['children'];
@@ -302,28 +479,66 @@ app.clientside_callback(
     [Input('demographics-dropdown', 'value'),
      Input('year-dropdown', 'value'),
      Input('DEMOGRAPHICS_OPTIONS', 'data'),
-     Input('MASTERFILE', 'data'),
+     Input('PLACE_INDEX', 'data'),
     ]
 )
 
 # Plot title
 app.clientside_callback(
     """
-    function(selected_tract, MASTERFILE) {
+    function(selected_tract, PLACE_INDEX) {
         if (selected_tract == undefined){
             return "Please click on a tract.";
         } else {
-            var selected_city = MASTERFILE[0]['CITY'];
+            var selected_city = PLACE_INDEX['CITY'];
             return `${selected_city}, ${selected_tract}`;
         }
     }
     """,
     Output('plot-title', 'children'),
     [Input('census-tract-dropdown', 'value'),
-     Input('MASTERFILE', 'data')
+     Input('PLACE_INDEX', 'data')
     ]
 )
 
+# Dollar year in the subtitle
+app.clientside_callback(
+    """
+    function(dollar_year) {
+        return dollar_year;
+    }
+    """,
+    Output('dollar-year-title', 'children'),
+    Input('dollar-year-dropdown', 'value')
+)
+
+
+# -- -- -- --
+# Downloads
+# -- -- -- --
+
+# Export API links of the current view (see `/api/export` in utils/data_api.py), one per format
+if EXPORT_URL:
+    app.clientside_callback(
+        """
+        function(selected_place, selected_year, selected_demographic, dollar_year, EXPORT_URL) {
+            return ['csv', 'ndjson', 'parquet'].map(format => EXPORT_URL + '?' + new URLSearchParams({
+                'place': selected_place, 'year': selected_year, 'demographic': selected_demographic, 'dollars': dollar_year, 'format': format
+            }).toString());
+        }
+        """,
+        [Output('download-csv', 'href'),
+         Output('download-ndjson', 'href'),
+         Output('download-parquet', 'href')
+        ],
+        [Input('place-dropdown', 'value'),
+         Input('year-dropdown', 'value'),
+         Input('demographics-dropdown', 'value'),
+         Input('dollar-year-dropdown', 'value'),
+         Input('EXPORT_URL', 'data')
+        ]
+    )
+
 
 # -- -- --
 # Graphs
@@ -332,86 +547,163 @@ app.clientside_callback(
 # Choropleth map
 app.clientside_callback(
     """
-    function(selected_demographic, selected_place, selected_year, selected_tract, MASTERFILE, LAT_LON){
-        var my_array = MASTERFILE.filter(item => item['YEAR'] == selected_year);
-        
-        var url_path = `https://raw.githubusercontent.com/ramindersinghdubb/Median-Household-Income-in-LA-County/refs/heads/main/data/mastergeometries/${selected_year}_mastergeometry.geojson`;
-        
-        var locations_array = my_array.map(({GEO_ID}) => GEO_ID);
-        var customdata_array = my_array.map(({TRACT}) => TRACT);
-
-        
-        var lat_lon_array = LAT_LON.filter(item => item['ABBREV_NAME'] === selected_place);
-        const lon_center = lat_lon_array[0]['LON_CENTER'];
-        const lat_center = lat_lon_array[0]['LAT_CENTER'];
-
-        eval(`var z_array = my_array.map( ( {${selected_demographic}} ) => ${selected_demographic});`)
-        
-        if (selected_demographic == 'B19013_001E') {
-            var map_title = "<b style='font-size:15px;'>Overall Population</b>  <br>";
-        } else if (selected_demographic == 'B19013A_001E') {
-            var map_title = "<b style='font-size:15px;'>White Householders</b>  <br>";
-        } else if (selected_demographic == 'B19013B_001E') {
-            var map_title = "<b style='font-size:15px;'>Black or African American  <br>Householders</b><br>";
-        } else if (selected_demographic == 'B19013C_001E') {
-            var map_title = "<b style='font-size:15px;'>American Indian and Alaska  <br>Native Householders</b><br>";
-        } else if (selected_demographic == 'B19013D_001E') {
-            var map_title = "<b style='font-size:15px;'>Asian Householders</b>  <br>";
-        } else if (selected_demographic == 'B19013E_001E') {
-            var map_title = "<b style='font-size:15px;'>Native Hawaiian and Other  <br>Pacific Islander Householders</b><br>";
-        } else if (selected_demographic == 'B19013F_001E') {
-            var map_title = "<b style='font-size:15px;'>Some Other Race Householders</b>  <br>";
-        } else if (selected_demographic == 'B19013G_001E') {
-            var map_title = "<b style='font-size:15px;'>Two or More Races Householders</b>  <br>";
-        } else if (selected_demographic == 'B19013H_001E') {
-            var map_title = "<b style='font-size:15px;'>White Alone, Not Hispanic or  <br>Latino Householders</b><br>";
-        } else if (selected_demographic == 'B19013I_001E') {
-            var map_title = "<b style='font-size:15px;'>Hispanic or Latino Householders</b>  <br>";
-        }
+    async function(selected_demographic, selected_place, selected_year, selected_tract, quantile_colorscale, dollar_year, map_mode, percent_change, PLACE_INDEX, LAT_LON, FIGURE_MANIFEST, DATA_URL, COUNTY_DISTRIBUTIONS, CPI_INDEX, HOVER_TITLES, PLACE_YEAR_OPTIONS, BOUNDARY_VINTAGES){
+        const sample = window.telemetry.start('map', selected_place, selected_year);
+        var url_path = `${DATA_URL}mastergeometries/${selected_year}_mastergeometry.geojson`;
 
+        // Dollar values are stored in nominal dollars of each year
+        const factor = window.cpi_factor(CPI_INDEX, selected_year, dollar_year);
 
-        var strings = my_array.map(function(item) {
-            return "<b style='font-size:16px;'>" + item['TRACT'] + "</b><br>" + item['CITY'] + ", Los Angeles County<br><br>"
-            + map_title
-            + "Median Household Income: <b style='font-size:14px; color:#597D35'>" + item[`${selected_demographic}_string`] + "</b>  <br>"
-            + "Margin of Error: <b style='font-size:14px; color:#597D35'>"         + item[`${selected_demographic.replace('_001E', '_001M')}_string`] + "</b>  <br>"
-            + "<extra></extra>";
-        });
-        
-        var data = [{
+        var lat_lon_array = LAT_LON.filter(item => item['ABBREV_NAME'] === selected_place);
+        var layout = {
+            'autosize': true,
+            'hoverlabel': {'align': 'left'},
+            'map': {'center': {'lat': lat_lon_array[0]['LAT_CENTER'], 'lon': lat_lon_array[0]['LON_CENTER']}, 'style': 'streets', 'zoom': 10},
+            'margin': {'b': 0, 'l': 0, 'r': 0, 't': 0},
+            'paper_bgcolor': '#FEF9F3',
+            'plot_bgcolor': '#FEF9F3',
+        };
+        var trace_style = {
             'type': 'choroplethmap',
-            'customdata': customdata_array,
             'geojson': url_path,
-            'locations': locations_array,
             'featureidkey': 'properties.GEO_ID',
+            'marker': {'line': {'color': '#020403', 'width': 1.75}, 'opacity': 0.7},
+            'hoverlabel': {'bgcolor': '#FAFAFA', 'bordercolor': '#BEBEBE', 'font': {'color': '#020403'}},
+            'hovertemplatefallback': 'Not available'
+        };
+
+        // Hover text of the income map: one static template filled in from each tract's customdata (tract,
+        // margin of error, percentile)
+        var income_hovertemplate = (CITY) => "<b style='font-size:16px;'>%{customdata[0]}</b><br>" + CITY + ", Los Angeles County<br><br>"
+            + HOVER_TITLES[selected_demographic]
+            + "Median Household Income: <b style='font-size:14px; color:#597D35'>%{z:$,.0f}</b>  <br>"
+            + "Margin of Error: <b style='font-size:14px; color:#597D35'>%{customdata[1]:$,.0f}</b>  <br>"
+            + "County Percentile: <b style='font-size:14px; color:#597D35'>%{customdata[2]}</b>  <br>"
+            + "<extra></extra>";
+        var income_colors = {
             'colorscale': 'Greens',
             'reversescale': true,
-            'z': z_array,
             'zmin': 0, 'zmax': 200000,
-            'marker': {'line': {'color': '#020403', 'width': 1.75}, 'opacity': 0.7},
-            'text': strings,
             'colorbar': {'outlinewidth': 2,
                          'ticklabelposition': 'outside bottom',
                          'tickprefix': '$',
                          'title': {'font': {'color': '#020403', 'weight': 500}, 'text': 'Median<br>Household<br>Income ($)'}},
-            'hoverlabel': {'bgcolor': '#FAFAFA', 'bordercolor': '#BEBEBE', 'font': {'color': '#020403'}},
-            'hovertemplate': '%{text}'
-        }];
-        
-        var layout = {
-            'autosize': true,
-            'hoverlabel': {'align': 'left'},
-            'map': {'center': {'lat': lat_center, 'lon': lon_center}, 'style': 'streets', 'zoom': 10},
-            'margin': {'b': 0, 'l': 0, 'r': 0, 't': 0},
-            'paper_bgcolor': '#FEF9F3',
-            'plot_bgcolor': '#FEF9F3',
         };
 
+        var figure = null;
+        if (map_mode == 'playback') {
+            // Every year of the place as Plotly animation frames that restyle only the locations, z and hover
+            // data. The years of a census tract boundary vintage share one geometry of the place (one trace per
+            // vintage, each drawn with its geometry up front), so that playing through the years loads nothing.
+            const years = (PLACE_YEAR_OPTIONS[selected_place] ?? []).filter(option => !option['disabled']).map(option => option['value']);
+            const factors = Object.fromEntries(years.map(year => [year, window.cpi_factor(CPI_INDEX, year, dollar_year)]));
+            const playback = await window.place_data.request('playback_arrays', {
+                'base': window.place_data.url(DATA_URL, 'masterfiles/'), 'place': selected_place,
+                'years': years, 'demographic': selected_demographic, 'factors': factors
+            }, sample);
+            const vintages = [...new Set(years.map(year => BOUNDARY_VINTAGES[year]))];
+            const frame_data = (frame) => vintages.map(vintage => BOUNDARY_VINTAGES[frame['year']] == vintage
+                ? {'locations': frame['locations'], 'z': frame['z'], 'customdata': frame['customdata']}
+                : {'locations': [], 'z': [], 'customdata': []});
+            const frames = playback['frames'].map(frame => ({'name': String(frame['year']), 'data': frame_data(frame), 'traces': vintages.map((_, idx) => idx)}));
+            const active = Math.max(0, years.indexOf(selected_year));
+
+            // Map traces are redrawn rather than transitioned from frame to frame
+            const animation = (frame_duration) => ({'mode': 'immediate', 'fromcurrent': true, 'transition': {'duration': 0},
+                                                    'frame': {'duration': frame_duration, 'redraw': true}});
+            figure = {
+                'data': vintages.map((vintage, idx) => Object.assign({}, trace_style, income_colors, frames[active]['data'][idx], {
+                    'geojson': `${DATA_URL}mastergeometries/places/${selected_place}_${vintage}_geometry.geojson`,
+                    'showscale': idx == 0,
+                    'hovertemplate': income_hovertemplate(playback['CITY']),
+                })),
+                'frames': frames,
+                'layout': Object.assign(layout, {
+                    'sliders': [{'active': active, 'x': 0.12, 'len': 0.86, 'y': 0, 'yanchor': 'bottom', 'bgcolor': '#FEF9F3',
+                                 'currentvalue': {'prefix': 'Year: ', 'font': {'color': '#020403'}},
+                                 'steps': frames.map(frame => ({'label': frame['name'], 'method': 'animate',
+                                                                'args': [[frame['name']], animation(0)]}))}],
+                    'updatemenus': [{'type': 'buttons', 'showactive': false, 'direction': 'left', 'x': 0.01, 'y': 0, 'xanchor': 'left', 'yanchor': 'bottom',
+                                     'buttons': [{'label': '▶', 'method': 'animate', 'args': [null, animation(1000)]},
+                                                 {'label': '❚❚', 'method': 'animate', 'args': [[null], animation(0)]}]}],
+                }),
+            };
+        } else if (map_mode == 'latest' || map_mode == 'yoy') {
+            // Change layers (see utils/changes.py), drawn as they are stored: a diverging color scale for the
+            // changes beyond their margin of error, gray for those inside it
+            const factors = Object.fromEntries(Object.keys(CPI_INDEX).map(year => [year, window.cpi_factor(CPI_INDEX, year, dollar_year)]));
+            const changes = await window.place_data.request('change_arrays', {
+                'url': window.place_data.url(DATA_URL, `changes/${selected_place}_${selected_year}_changes.json`),
+                'year': selected_year, 'demographic': selected_demographic, 'comparison': map_mode,
+                'percent': percent_change, 'factors': factors
+            }, sample);
+            if (changes == null) {
+                var text = map_mode == 'latest' ? `${selected_year} is the most recent year.` : `No data for the year before ${selected_year}.`;
+                figure = {'data': [], 'layout': Object.assign(layout, {'annotations': [{'text': text, 'showarrow': false, 'x': 0.5, 'y': 0.5,
+                                                                                         'xref': 'paper', 'yref': 'paper', 'font': {'size': 16}}]})};
+            } else {
+                var from_year = map_mode == 'latest' ? selected_year : changes['year'];
+                var to_year = map_mode == 'latest' ? changes['year'] : selected_year;
+                var hovertemplate = "<b style='font-size:16px;'>%{customdata[0]}</b><br>" + PLACE_INDEX['CITY'] + ", Los Angeles County<br><br>"
+                    + HOVER_TITLES[selected_demographic]
+                    + `Change, ${from_year} to ${to_year}: <b style='font-size:14px; color:#597D35'>%{customdata[1]:$,.0f}</b> (%{customdata[2]:+.1f}%)  <br>`
+                    + "Margin of Error: <b style='font-size:14px; color:#597D35'>%{customdata[3]:$,.0f}</b>  <br>";
+                var colorbar_title = `Change,<br>${from_year}<br>to ${to_year}` + (percent_change ? ' (%)' : ' ($)');
+                figure = {'data': [
+                    Object.assign({}, trace_style, changes['beyond'], {
+                        'colorscale': 'RdBu', 'zmid': 0, 'zmin': -changes['zmax'], 'zmax': changes['zmax'],
+                        'colorbar': {'outlinewidth': 2, 'ticklabelposition': 'outside bottom',
+                                     'tickprefix': percent_change ? '' : '$', 'ticksuffix': percent_change ? '%' : '',
+                                     'title': {'font': {'color': '#020403', 'weight': 500}, 'text': colorbar_title}},
+                        'hovertemplate': hovertemplate + "Beyond the margin of error<extra></extra>",
+                    }),
+                    Object.assign({}, trace_style, changes['inside'], {
+                        'colorscale': [[0, '#BDBDBD'], [1, '#BDBDBD']], 'showscale': false,
+                        'hovertemplate': hovertemplate + "Inside the margin of error<extra></extra>",
+                    }),
+                    Object.assign({}, trace_style, changes['missing'], {
+                        'z': new Float64Array(changes['missing']['locations'].length),
+                        'colorscale': [[0, 'rgba(0,0,0,0)'], [1, 'rgba(0,0,0,0)']], 'showscale': false,
+                        'hovertemplate': "<b style='font-size:16px;'>%{customdata[0]}</b><br>No change to compare<extra></extra>",
+                    }),
+                ], 'layout': layout};
+            }
+        } else if ((FIGURE_MANIFEST ?? {})['dollar_year'] == dollar_year) {
+            figure = await window.figure_cache.fetch_figure(FIGURE_MANIFEST, selected_place, 'map', selected_year, selected_demographic);
+        }
+        if (figure == null) {
+            // Trace arrays built by the place data worker: locations and z as (transferred) Float64Arrays,
+            // customdata as [tract, margin of error, percentile]
+            const arrays = await window.place_data.request('map_arrays', {
+                'base': window.place_data.url(DATA_URL, 'masterfiles/'), 'place': selected_place,
+                'year': selected_year, 'demographic': selected_demographic, 'factor': factor
+            }, sample);
+
+            var data = [Object.assign({}, trace_style, income_colors, {
+                'customdata': arrays['customdata'],
+                'locations': arrays['locations'],
+                'z': arrays['z'],
+                'hovertemplate': income_hovertemplate(arrays['z'].length ? arrays['CITY'] : ''),
+            })];
+
+            figure = {'data': data, 'layout': layout};
+        }
+
+        // Quantile-based color scale from the county-wide distribution (in nominal dollars; the color scale
+        // positions are relative, so only its range is adjusted)
+        if (map_mode == 'level' && quantile_colorscale && COUNTY_DISTRIBUTIONS != undefined) {
+            var distribution = (COUNTY_DISTRIBUTIONS[selected_year] || {})[selected_demographic];
+            if (distribution != undefined && distribution['colorscale'] != undefined) {
+                Object.assign(figure['data'][0], {'colorscale': distribution['colorscale'], 'reversescale': false,
+                                                  'zmin': distribution['zmin'] * factor, 'zmax': distribution['zmax'] * factor});
+            }
+        }
+
 
-        if (selected_tract != undefined){
-            var aux_array = my_array.filter(item => item['TRACT'] === selected_tract);
-            var aux_locations_array = aux_array.map(({GEO_ID}) => GEO_ID);
-            var aux_z_array = aux_array.map(({GEO_ID})=>GEO_ID);
+        var selected_geo_id = ((PLACE_INDEX ?? {'GEO_IDS': {}})['GEO_IDS'][selected_year] ?? {})[selected_tract];
+        if (selected_tract != undefined && map_mode != 'playback'){
+            var aux_locations_array = selected_geo_id != undefined ? [selected_geo_id] : [];
+            var aux_z_array = aux_locations_array;
                 
             var aux_data = {
                 'type': 'choroplethmap',
@@ -426,10 +718,10 @@ app.clientside_callback(
                 'selected': {'marker': {'opacity': 0.4}},
                 'hoverinfo': 'skip',
             }
-            data.push(aux_data);
+            figure['data'].push(aux_data);
         }
 
-        return {'data': data, 'layout': layout};
+        return window.telemetry.figure(sample, 'chloropleth_map', figure);
 
     }
     """,
@@ -438,8 +730,19 @@ app.clientside_callback(
      Input('place-dropdown', 'value'),
      Input('year-dropdown', 'value'),
      Input('census-tract-dropdown', 'value'),
-     Input('MASTERFILE', 'data'),
+     Input('quantile-colorscale-switch', 'value'),
+     Input('dollar-year-dropdown', 'value'),
+     Input('map-mode', 'value'),
+     Input('change-percent-switch', 'value'),
+     Input('PLACE_INDEX', 'data'),
      Input('LAT-LON', 'data'),
+     Input('FIGURE_MANIFEST', 'data'),
+     Input('DATA_URL', 'data'),
+     Input('COUNTY_DISTRIBUTIONS', 'data'),
+     Input('CPI_INDEX', 'data'),
+     Input('HOVER_TITLES', 'data'),
+     Input('PLACE_YEAR_OPTIONS', 'data'),
+     Input('BOUNDARY_VINTAGES', 'data'),
     ]
 )
 
@@ -448,97 +751,79 @@ app.clientside_callback(
 # Plot
 app.clientside_callback(
     """
-    function(selected_demographic, selected_place, selected_tract, MASTERFILE){        
-        if (selected_tract != undefined) {
-            var my_array = MASTERFILE.filter(item => item['TRACT'] === selected_tract);
-            var my_array = my_array.sort((a, b) => a.YEAR - b.YEAR);
-
-            var x_array = my_array.map( ({YEAR}) => YEAR );
-            eval(`var y_array = my_array.map( ( { ${selected_demographic} } ) => ${selected_demographic});`)
-            eval(`var y_margin_arr = my_array.map( ( { ${selected_demographic.replace('_001E', '_001M')} } ) => ${selected_demographic.replace('_001E', '_001M')});`)
-            var y_upper_arr = y_array.map((y, idx) => y + y_margin_arr[idx]);
-            var y_lower_arr = y_array.map((y, idx) => y - y_margin_arr[idx]);
-            var y_lower_arr = y_lower_arr.map(num => num <= 0 ? 0 : num);
-
-            if (selected_demographic == 'B19013_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Overall Population</b>  <br>";
-            } else if (selected_demographic == 'B19013A_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>White Householders</b>  <br>";
-            } else if (selected_demographic == 'B19013B_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Black or African American  <br>Householders</b><br>";
-            } else if (selected_demographic == 'B19013C_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>American Indian and Alaska  <br>Native Householders</b><br>";
-            } else if (selected_demographic == 'B19013D_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Asian Householders</b>  <br>";
-            } else if (selected_demographic == 'B19013E_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Native Hawaiian and Other  <br>Pacific Islander Householders</b><br>";
-            } else if (selected_demographic == 'B19013F_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Some Other Race Householders</b>  <br>";
-            } else if (selected_demographic == 'B19013G_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Two or More Races Householders</b>  <br>";
-            } else if (selected_demographic == 'B19013H_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>White Alone, Not Hispanic or  <br>Latino Householders</b><br>";
-            } else if (selected_demographic == 'B19013I_001E') {
-                var plot_title_text = "<b style='font-size:15px;'>Hispanic or Latino Householders</b>  <br>";
+    async function(selected_demographic, selected_place, selected_year, selected_tract, dollar_year, PLACE_INDEX, FIGURE_MANIFEST, DATA_URL, CPI_INDEX, HOVER_TITLES){
+        if (selected_tract != undefined && PLACE_INDEX != undefined) {
+            var geo_id = (PLACE_INDEX['GEO_IDS'][selected_year] ?? {})[selected_tract];
+            if (geo_id == undefined) {
+                return window.dash_clientside.no_update;
             }
 
-            var strings = my_array.map(function(item) {
-                return "<b style='font-size:16px;'>" + item['YEAR'] + "</b><br>" + item['TRACT'] + ", " + item['CITY'] + " <br><br>"
-                + plot_title_text
-                + "Median Household Income: <b style='font-size:14px; color:#597D35'>" + item[`${selected_demographic}_string`] + "</b>  <br>"
-                + "Margin of Error: <b style='font-size:14px; color:#597D35'>"         + item[`${selected_demographic.replace('_001E', '_001M')}_string`] + "</b>  <br>"
-                + "<extra></extra>";
-            });
-            var upper_strings = my_array.map(function(item) {
-                const num = (parseFloat(item[`${selected_demographic}`]) + parseFloat(item[`${selected_demographic.replace('_001E', '_001M')}`]));
-                const fmt_num = isNaN(num) ? 'Not available!' : '$' + num.toString();
-
-                return "<b style='font-size:16px;'>" + item['YEAR'] + "</b><br>" + item['TRACT'] + ", " + item['CITY'] + " <br><br>"
-                + "Upper Estimate: <b style='font-size:14px; color:#597D35'>" + fmt_num + "</b>  <br>"
-                + "<extra></extra>";
-            });
-            var lower_strings = my_array.map(function(item) {
-                const num = (parseFloat(item[`${selected_demographic}`]) - parseFloat(item[`${selected_demographic.replace('_001E', '_001M')}`]));
-                const fmt_num = isNaN(num) ? 'Not available!' : num <= 0 ? '$0' : '$' + num.toString();
-                
+            const sample = window.telemetry.start('plot', selected_place, selected_year);
+            if ((FIGURE_MANIFEST ?? {})['dollar_year'] == dollar_year) {
+                var figure = await window.figure_cache.fetch_figure(FIGURE_MANIFEST, selected_place, 'plot', geo_id, selected_demographic);
+                if (figure != null) {
+                    return window.telemetry.figure(sample, 'income_plot', figure);
+                }
+            }
 
-                return "<b style='font-size:16px;'>" + item['YEAR'] + "</b><br>" + item['TRACT'] + ", " + item['CITY'] + " <br><br>"
-                + "Lower Estimate: <b style='font-size:14px; color:#597D35'>" + fmt_num + "</b>  <br>"
+            // The tract's time series, in dollars of the selected year (one factor per year), built by the place
+            // data worker: x/y arrays as (transferred) Float64Arrays, customdata as [tract, margin of error]
+            var factors = Object.fromEntries(Object.keys(CPI_INDEX).map(year => [year, window.cpi_factor(CPI_INDEX, year, dollar_year)]));
+            const arrays = await window.place_data.request('plot_arrays', {
+                'base': window.place_data.url(DATA_URL, 'masterfiles/'), 'place': selected_place,
+                'geo_id': geo_id, 'demographic': selected_demographic, 'factors': factors
+            }, sample);
+            if (arrays == null) {
+                return window.dash_clientside.no_update;
+            }
+            var x_array = arrays['x'];
+            var customdata_array = arrays['customdata'];
+
+            // Hover text: static templates filled in from each year's customdata (tract, margin of error)
+            var header = "<b style='font-size:16px;'>%{x}</b><br>%{customdata[0]}, " + PLACE_INDEX['CITY'] + " <br><br>";
+            var hovertemplate = header
+                + HOVER_TITLES[selected_demographic]
+                + "Median Household Income: <b style='font-size:14px; color:#597D35'>%{y:$,.0f}</b>  <br>"
+                + "Margin of Error: <b style='font-size:14px; color:#597D35'>%{customdata[1]:$,.0f}</b>  <br>"
                 + "<extra></extra>";
-            });
+            var upper_hovertemplate = header + "Upper Estimate: <b style='font-size:14px; color:#597D35'>%{y:$,.0f}</b>  <br>" + "<extra></extra>";
+            var lower_hovertemplate = header + "Lower Estimate: <b style='font-size:14px; color:#597D35'>%{y:$,.0f}</b>  <br>" + "<extra></extra>";
 
             var data = [{'type': 'scatter',
                 'x': x_array,
-                'y': y_array,
+                'y': arrays['y'],
                 'mode': 'lines+markers',
                 'line': {'color': '#014421'},
                 'marker': {'size': 10, 'line': {'width': 2, 'color': '#F5FBFF'}},
-                'text': strings,
+                'customdata': customdata_array,
                 'hoverlabel': {'bgcolor': '#FAFAFA', 'bordercolor': '#BEBEBE', 'font': {'color': '#020403'}},
-                'hovertemplate': '%{text}',
+                'hovertemplate': hovertemplate,
+                'hovertemplatefallback': 'Not available',
                 'showlegend': false,
                 'zorder': 1
             }, {'type': 'scatter',
                 'x': x_array,
-                'y': y_upper_arr,
+                'y': arrays['upper'],
                 'mode': 'lines',
                 'marker': {'color': '#83e6b5'},
                 'line': {'width': 0},
-                'text': upper_strings,
+                'customdata': customdata_array,
                 'hoverlabel': {'bgcolor': '#FAFAFA', 'bordercolor': '#BEBEBE', 'font': {'color': '#020403'}},
-                'hovertemplate': '%{text}',
+                'hovertemplate': upper_hovertemplate,
+                'hovertemplatefallback': 'Not available',
                 'showlegend': false,
             }, {'type': 'scatter',
                 'x': x_array,
-                'y': y_lower_arr,
+                'y': arrays['lower'],
                 'mode': 'lines',
                 'fill': 'tonexty',
                 'fillcolor': 'rgba(153, 170, 187, 0.5)',
                 'marker': {'color': '#83e6b5'},
                 'line': {'width': 0},
-                'text': lower_strings,
+                'customdata': customdata_array,
                 'hoverlabel': {'bgcolor': '#FAFAFA', 'bordercolor': '#BEBEBE', 'font': {'color': '#020403'}},
-                'hovertemplate': '%{text}',
+                'hovertemplate': lower_hovertemplate,
+                'hovertemplatefallback': 'Not available',
                 'showlegend': false,
             }];
         
@@ -557,15 +842,21 @@ app.clientside_callback(
                 'yaxis': {'title': {'text': '<b>Income ($)</b>', 'standoff': 15, 'font': {'size': 14}}, 'tickprefix': '$', 'gridcolor': '#E0E0E0', 'ticklabelstandoff': 5, 'ticks': '', 'tickfont': {'color': '#666666'}},
             };
 
-            return {'data': data, 'layout': layout};
+            return window.telemetry.figure(sample, 'income_plot', {'data': data, 'layout': layout});
         }
     }
     """,
     Output('income_plot', 'figure'),
     [Input('demographics-dropdown', 'value'),
      Input('place-dropdown', 'value'),
+     Input('year-dropdown', 'value'),
      Input('census-tract-dropdown', 'value'),
-     Input('MASTERFILE', 'data')
+     Input('dollar-year-dropdown', 'value'),
+     Input('PLACE_INDEX', 'data'),
+     Input('FIGURE_MANIFEST', 'data'),
+     Input('DATA_URL', 'data'),
+     Input('CPI_INDEX', 'data'),
+     Input('HOVER_TITLES', 'data')
     ]
 )
 
@@ -0,0 +1,11 @@
+// Factor converting nominal dollars of a year to dollars of the base year with the R-CPI-U-RS annual
+// averages, rounded to 5 decimals as in `adjustment_factors()` in utils/currency.py.
+window.cpi_factor = function(CPI_INDEX, year, base_year) {
+    return Math.round(CPI_INDEX[base_year] / CPI_INDEX[year] * 1e5) / 1e5;
+};
+
+// Nominal dollar value in dollars of the base year, given its factor (null for missing values), rounded halves
+// up as `round_half_up()` in utils/currency.py, so that it matches the precomputed figures and the exports.
+window.adjust_dollars = function(value, factor) {
+    return (value === null || value === undefined) ? null : Math.round(value * factor);
+};
@@ -0,0 +1,35 @@
+// Precomputed figure cache for the static deployment (see utils/figure_cache.py).
+// Figures are gzip-compressed JSON objects, addressed by the hashes in a per-place manifest.
+window.figure_cache = {
+    fetch_manifest: async function(selected_place) {
+        try {
+            const response = await fetch(`figures/manifests/${selected_place}.json`);
+            if (!response.ok) {
+                return null;
+            }
+            return await response.json();
+        } catch (error) {
+            return null;
+        }
+    },
+
+    fetch_figure: async function(FIGURE_MANIFEST, selected_place, ...keys) {
+        if (FIGURE_MANIFEST == undefined || FIGURE_MANIFEST['place'] !== selected_place) {
+            return null;
+        }
+        var hash = keys.reduce((item, key) => (item == undefined ? undefined : item[key]), FIGURE_MANIFEST);
+        if (hash == undefined) {
+            return null;
+        }
+        try {
+            const response = await fetch(`figures/objects/${hash}.json.gz`);
+            if (!response.ok) {
+                return null;
+            }
+            const stream = response.body.pipeThrough(new DecompressionStream('gzip'));
+            return await new Response(stream).json();
+        } catch (error) {
+            return null;
+        }
+    }
+};
@@ -0,0 +1,84 @@
+// Client of the place data worker (assets/workers/place_data.js): the callbacks request decoded, indexed
+// place data and ready-made trace arrays from it, so that parsing and indexing a place's masterfile does not
+// block the main thread (dropdowns and the map stay responsive while a place loads).
+(function() {
+    const worker_url = new URL('workers/place_data.js', document.currentScript.src).href;
+    const pending = new Map();
+    let worker = null;
+    let next_id = 0;
+
+    // Time to first map: from a place's index being requested to its first map arrays being ready (rendering
+    // excluded), one entry per place change, e.g. `window.place_data.first_map` in the console
+    const first_map = [];
+    let current_place = null;
+    let place_start = null;
+
+    function time_first_map(params, result) {
+        if (params['place'] === current_place && place_start != null) {
+            first_map.push({'place': current_place, 'year': params['year'], 'ms': Math.round(performance.now() - place_start),
+                            'tracts': result['z'].length});
+            place_start = null;
+        }
+    }
+
+    function get_worker() {
+        if (worker == null) {
+            worker = new Worker(worker_url);
+            worker.onmessage = function(event) {
+                const {id, result, timings, error} = event.data;
+                const request = pending.get(id);
+                pending.delete(id);
+                if (error !== undefined) {
+                    request.reject(new Error(error));
+                } else {
+                    if (request.sample != null) {
+                        window.telemetry.add(request.sample, timings, performance.now() - request.start);
+                    }
+                    request.resolve(result);
+                }
+            };
+        }
+        return worker;
+    }
+
+    window.place_data = {
+        // Request from the worker, e.g. request('map_arrays', {base, place, year, demographic, factor}), adding
+        // its timings to a telemetry sample if given (see assets/telemetry.js)
+        request: function(type, params, sample = null) {
+            if (type === 'place_index' && params['place'] !== current_place) {
+                current_place = params['place'];
+                place_start = performance.now();
+            }
+            return new Promise((resolve, reject) => {
+                const id = next_id++;
+                pending.set(id, {resolve, reject, sample, start: performance.now()});
+                get_worker().postMessage({id, type, params});
+            }).then(result => {
+                if (type === 'map_arrays') {
+                    time_first_map(params, result);
+                }
+                return result;
+            });
+        },
+
+        first_map: first_map,
+
+        // Absolute URL of a data file (the worker resolves relative URLs against its own script URL)
+        url: function(DATA_URL, path) {
+            return new URL(`${DATA_URL}${path}`, document.baseURI).href;
+        },
+    };
+
+    // Main-thread long tasks (over 50 ms), e.g. `window.long_tasks` in the console before and after a place change
+    window.long_tasks = {count: 0, total_ms: 0, max_ms: 0,
+                         reset: function() { Object.assign(this, {count: 0, total_ms: 0, max_ms: 0}); }};
+    if (window.PerformanceObserver && (PerformanceObserver.supportedEntryTypes ?? []).includes('longtask')) {
+        new PerformanceObserver(function(list) {
+            for (const entry of list.getEntries()) {
+                window.long_tasks.count += 1;
+                window.long_tasks.total_ms += entry.duration;
+                window.long_tasks.max_ms = Math.max(window.long_tasks.max_ms, entry.duration);
+            }
+        }).observe({type: 'longtask', buffered: true});
+    }
+})();
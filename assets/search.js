@@ -0,0 +1,63 @@
+// Type-ahead search over the county-wide search index (data/search_index.json), as `search()` in
+// utils/search.py: a query matches the entries holding, for each of its tokens, a token it is a prefix of.
+window.tract_search = (function() {
+    // Lowercase tokens of a text without accents, keeping decimal tract numbers whole (e.g. '5751.01')
+    function tokenize(text) {
+        return String(text).normalize('NFKD').replace(/[\u0300-\u036f]/g, '').toLowerCase().match(/[a-z0-9]+(?:\.[0-9]+)?/g) ?? [];
+    }
+
+    // First offset of the sorted tokens not before the prefix
+    function lower_bound(tokens, prefix) {
+        let low = 0, high = tokens.length;
+        while (low < high) {
+            const mid = (low + high) >> 1;
+            if (tokens[mid] < prefix) { low = mid + 1; } else { high = mid; }
+        }
+        return low;
+    }
+
+    // Entries holding a token starting with the prefix, and those holding the prefix as a whole token
+    function prefix_matches(index, prefix) {
+        const matches = new Set(), exact = new Set();
+        for (let i = lower_bound(index['tokens'], prefix); i < index['tokens'].length && index['tokens'][i].startsWith(prefix); i++) {
+            index['postings'][i].forEach(entry => matches.add(entry));
+            if (index['tokens'][i] === prefix) {
+                index['postings'][i].forEach(entry => exact.add(entry));
+            }
+        }
+        return [matches, exact];
+    }
+
+    return {
+        tokenize: tokenize,
+
+        // Places and census tracts matching a query, ranked by the number of query tokens they hold whole,
+        // then places before census tracts, then the most recent year first
+        search: function(index, text, limit = 10) {
+            const query_tokens = tokenize(text);
+            if (index == undefined || query_tokens.length === 0) {
+                return [];
+            }
+            let candidates = null;
+            const exact_counts = new Map();
+            for (const token of query_tokens) {
+                const [matches, exact] = prefix_matches(index, token);
+                candidates = candidates === null ? matches : new Set([...candidates].filter(entry => matches.has(entry)));
+                exact.forEach(entry => exact_counts.set(entry, (exact_counts.get(entry) ?? 0) + 1));
+            }
+            const entries = index['entries'];
+            const rank = entry => [-(exact_counts.get(entry) ?? 0), entries[entry][2] !== null ? 1 : 0, -entries[entry][1], entry];
+            const ranked = [...candidates].map(entry => [rank(entry), entry]).sort((a, b) => {
+                for (let i = 0; i < a[0].length; i++) {
+                    if (a[0][i] !== b[0][i]) { return a[0][i] - b[0][i]; }
+                }
+                return 0;
+            });
+            return ranked.slice(0, limit).map(([_, entry]) => {
+                const [place, YEAR, TRACT, GEO_ID] = entries[entry];
+                const [ABBREV_NAME, CITY] = index['places'][place];
+                return {'ABBREV_NAME': ABBREV_NAME, 'CITY': CITY, 'YEAR': YEAR, 'TRACT': TRACT, 'GEO_ID': GEO_ID};
+            });
+        },
+    };
+})();
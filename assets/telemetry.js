@@ -0,0 +1,106 @@
+// Real-user telemetry: timings of each place index, map and plot update as users experience them (see
+// utils/telemetry.py for the metrics), sent in batches with `navigator.sendBeacon` to the URL of the
+// `telemetry-url` meta tag (none: telemetry is off). The samples not sent yet are in `window.telemetry.queue`.
+window.telemetry = (function() {
+    const meta = document.querySelector('meta[name="telemetry-url"]');
+    const url = meta && meta.content ? new URL(meta.content, document.baseURI).href : null;
+    const MAX_QUEUE = 20;
+    const FLUSH_MS = 30000;
+    const RENDER_TIMEOUT_MS = 10000;
+    const queue = [];
+
+    function round(value) {
+        return Math.round(value * 10) / 10;
+    }
+
+    function flush() {
+        if (url == null || queue.length === 0 || !navigator.sendBeacon) {
+            return;
+        }
+        const samples = queue.splice(0, queue.length);
+        navigator.sendBeacon(url, new Blob([JSON.stringify({'samples': samples})], {type: 'application/json'}));
+    }
+
+    function send(sample) {
+        if (sample['done']) {
+            return;
+        }
+        sample['done'] = true;
+        const {start, wait_ms, done, ...metrics} = sample;
+        for (const metric of ['fetch_ms', 'parse_ms', 'build_ms', 'render_ms', 'total_ms']) {
+            if (metrics[metric] != undefined) {
+                metrics[metric] = round(metrics[metric]);
+            }
+        }
+        queue.push(metrics);
+        if (queue.length >= MAX_QUEUE) {
+            flush();
+        }
+    }
+
+    if (url != null) {
+        setInterval(flush, FLUSH_MS);
+        document.addEventListener('visibilitychange', function() {
+            if (document.visibilityState === 'hidden') {
+                flush();
+            }
+        });
+        window.addEventListener('pagehide', flush);
+    }
+
+    return {
+        queue: queue,
+
+        // New sample of an interaction ('place_index', 'map' or 'plot'), timed from now
+        start: function(kind, place, year) {
+            return {'kind': kind, 'place': place, 'year': year, 'start': performance.now(), 'wait_ms': 0,
+                    'fetch_ms': 0, 'bytes': 0, 'parse_ms': 0, 'build_ms': 0};
+        },
+
+        // Adds the timings of a place data worker request (see assets/workers/place_data.js) and the time the
+        // callback waited for it
+        add: function(sample, timings, wait_ms) {
+            for (const metric of ['fetch_ms', 'bytes', 'parse_ms', 'build_ms']) {
+                sample[metric] += timings[metric] ?? 0;
+            }
+            sample['wait_ms'] += wait_ms;
+        },
+
+        // Ends a sample without a figure (e.g. the place index)
+        end: function(sample) {
+            sample['total_ms'] = performance.now() - sample['start'];
+            send(sample);
+        },
+
+        // Ends the building of a figure about to be returned to a graph, and times its drawing up to the graph's
+        // next `plotly_afterplot` event. Returns the figure.
+        figure: function(sample, graph_id, figure) {
+            const built = performance.now();
+            sample['build_ms'] += Math.max(0, built - sample['start'] - sample['wait_ms']);
+            const rendered = function() {
+                const now = performance.now();
+                sample['render_ms'] = now - built;
+                sample['total_ms'] = now - sample['start'];
+                send(sample);
+            };
+            const graph = document.querySelector(`#${graph_id} .js-plotly-plot`);
+            if (graph != null && typeof graph.once === 'function') {
+                graph.once('plotly_afterplot', rendered);
+            } else {
+                // Not drawn yet: waits for the graph to be mounted
+                const poll = function() {
+                    const mounted = document.querySelector(`#${graph_id} .js-plotly-plot`);
+                    if (mounted != null && typeof mounted.once === 'function') {
+                        mounted.once('plotly_afterplot', rendered);
+                    } else if (!sample['done']) {
+                        requestAnimationFrame(poll);
+                    }
+                };
+                requestAnimationFrame(poll);
+            }
+            // Sent without render_ms if the figure is never drawn (e.g. replaced by a newer one first)
+            setTimeout(() => send(sample), RENDER_TIMEOUT_MS);
+            return figure;
+        },
+    };
+})();
@@ -0,0 +1,223 @@
+// Web Worker decoding and indexing place data off the main thread (see assets/place_data.js).
+//
+// A place's data is loaded year first: the selected year's masterfile (masterfiles/years/) is fetched, parsed
+// and indexed into columns of Float64Arrays (NaN for missing values) in GEO_ID order, and the map is drawn from
+// it. The place's tract series (for the plot) and its other years (for year switches) are then streamed in the
+// background. The callbacks request ready-made trace arrays (map z/locations, plot x/y), which are posted back
+// with their buffers transferred rather than copied. Not listed by Dash (assets_path_ignore), so it never runs
+// on the main thread.
+
+const ID_COLUMNS = ['YEAR', 'GEO_ID', 'TRACT', 'CITY', 'COUNTY', 'STATE', 'ABBREV_NAME'];
+const MAX_FILES = 64;
+
+// url -> Promise of an indexed year masterfile or tract series, most recently used last
+const cache = new Map();
+
+// Place whose other years are being streamed in (a place change stops the stream)
+let streaming = null;
+
+// Loaded on a miss with `load(url, timings)`; the download and parse times of a load count towards the
+// timings of the request that started it (see `self.onmessage`)
+function cached(url, load, timings = null) {
+    if (!cache.has(url)) {
+        cache.set(url, load(url, timings).catch(error => { cache.delete(url); throw error; }));
+        while (cache.size > MAX_FILES) {
+            cache.delete(cache.keys().next().value);
+        }
+    } else {
+        const value = cache.get(url);
+        cache.delete(url);
+        cache.set(url, value);
+    }
+    return cache.get(url);
+}
+
+// Adds a duration or size to a request's timings (none for background loads)
+function add_timing(timings, metric, value) {
+    if (timings) {
+        timings[metric] += value;
+    }
+}
+
+async function fetch_json(url, timings = null) {
+    const start = performance.now();
+    const response = await fetch(url);
+    if (!response.ok) {
+        throw new Error(`${url}: HTTP ${response.status}`);
+    }
+    const buffer = await response.arrayBuffer();
+    const parse_start = performance.now();
+    const data = JSON.parse(new TextDecoder().decode(buffer));
+    // Bytes transferred: the Content-Length of the (possibly gzipped) body, else the size of the decoded body
+    const length = Number(response.headers.get('Content-Length'));
+    add_timing(timings, 'fetch_ms', parse_start - start);
+    add_timing(timings, 'bytes', length > 0 ? length : buffer.byteLength);
+    add_timing(timings, 'parse_ms', performance.now() - parse_start);
+    return data;
+}
+
+function year_url(base, place, year) {
+    return `${base}years/${place}_${year}_masterfile.json`;
+}
+
+// Year masterfile records (sorted by GEO_ID) -> {CITY, GEO_ID, TRACT, columns: {col: Float64Array}}
+function index_year(records) {
+    const columns = records.length ? Object.keys(records[0]).filter(col => !ID_COLUMNS.includes(col) && !col.endsWith('_string')) : [];
+    const year = {'CITY': records.length ? records[0]['CITY'] : null, 'GEO_ID': Float64Array.from(records, row => row['GEO_ID']),
+                  'TRACT': records.map(row => row['TRACT']), 'columns': {}};
+    for (const col of columns) {
+        year['columns'][col] = Float64Array.from(records, row => row[col] ?? NaN);
+    }
+    return year;
+}
+
+async function load_year(url, timings = null) {
+    const records = await fetch_json(url, timings);
+    const start = performance.now();
+    const year = index_year(records);
+    add_timing(timings, 'parse_ms', performance.now() - start);
+    return year;
+}
+
+// The tract series, then the other years nearest to the selected year first, one at a time so that they do
+// not compete with the selected year's geometry for bandwidth
+async function stream(base, place, year, years) {
+    const key = `${base}${place}`;
+    streaming = key;
+    const others = years.filter(other => other != year).sort((a, b) => Math.abs(a - year) - Math.abs(b - year));
+    const files = [[`${base}${place}_series.json`, fetch_json], ...others.map(other => [year_url(base, place, other), load_year])];
+    for (const [url, load] of files) {
+        if (streaming !== key) {
+            return;
+        }
+        try {
+            await cached(url, load);
+        } catch (error) {
+            // Requested again (and reported) if the callbacks need it
+        }
+    }
+}
+
+// Nominal dollars to dollars of the selected year (NaN for missing values), rounded halves up as window.adjust_dollars
+function adjusted(values, factor) {
+    return values.map(value => Math.round(value * factor));
+}
+
+function nullable(value) {
+    return Number.isNaN(value) ? null : value;
+}
+
+// Choropleth arrays of an indexed year masterfile and demographic, in dollars of the selected year
+function map_frame(data, demographic, factor) {
+    const margins = adjusted(data['columns'][demographic.replace('_001E', '_001M')], factor);
+    const pctiles = data['columns'][`${demographic}_pctile`] ?? new Float64Array(data['TRACT'].length).fill(NaN);
+    return {
+        'locations': data['GEO_ID'].slice(),
+        'z': adjusted(data['columns'][demographic], factor),
+        'customdata': data['TRACT'].map((tract, idx) => [tract, nullable(margins[idx]), nullable(pctiles[idx])]),
+    };
+}
+
+const handlers = {
+    // Tract labels and GEO_IDs of the selected year, and the place name, for the dropdowns and titles. Loads the
+    // selected year first and then streams in the rest of the place (`years`: all years of the place)
+    place_index: async function({base, place, year, years}, timings) {
+        const data = await cached(year_url(base, place, year), load_year, timings);
+        stream(base, place, year, years);
+        return {'CITY': data['CITY'],
+                'GEO_IDS': {[year]: Object.fromEntries(data['TRACT'].map((tract, idx) => [tract, data['GEO_ID'][idx]]))}};
+    },
+
+    // Arrays of the choropleth trace of a year and demographic, in dollars of the selected year
+    map_arrays: async function({base, place, year, demographic, factor}, timings) {
+        const data = await cached(year_url(base, place, year), load_year, timings);
+        return Object.assign({'CITY': data['CITY']}, map_frame(data, demographic, factor));
+    },
+
+    // Arrays of every year of a place for the map's playback mode, one frame per year, each in dollars of the
+    // selected year (`factors`: one dollar factor per year). The years come from the cache once streamed in.
+    playback_arrays: async function({base, place, years, demographic, factors}, timings) {
+        const datas = await Promise.all(years.map(year => cached(year_url(base, place, year), load_year, timings)));
+        return {
+            'CITY': datas.length ? datas[0]['CITY'] : null,
+            'frames': datas.map((data, idx) => Object.assign({'year': years[idx]}, map_frame(data, demographic, factors[years[idx]]))),
+        };
+    },
+
+    // Arrays of the change map of a year and demographic (see utils/changes.py): the census tracts whose change
+    // is beyond its margin of error, inside it, and without a change, each as locations, z (the change in
+    // dollars of the selected year, or in percent) and customdata [tract, change, percent, margin of error].
+    // `factors`: one dollar factor per year, applied to the dollars of the later year of the comparison.
+    // Null if the year has no such comparison (e.g. the most recent year to itself).
+    change_arrays: async function({url, year, demographic, comparison, percent, factors}, timings) {
+        const changes = await cached(url, fetch_json, timings);
+        if (changes[comparison] == undefined) {
+            return null;
+        }
+        const layers = changes[comparison][demographic];
+        const factor = factors[comparison === 'latest' ? changes[comparison]['year'] : year];
+        const dollars = (value) => value == null ? null : Math.round(value * factor);
+
+        const groups = {'beyond': [], 'inside': [], 'missing': []};
+        changes['GEO_ID'].forEach((geo_id, idx) => {
+            const group = layers['change'][idx] == null ? 'missing' : (layers['inside_moe'][idx] ? 'inside' : 'beyond');
+            groups[group].push(idx);
+        });
+        const arrays = (indices) => ({
+            'locations': Float64Array.from(indices, idx => changes['GEO_ID'][idx]),
+            'z': Float64Array.from(indices, idx => (percent ? layers['pct'][idx] : dollars(layers['change'][idx])) ?? NaN),
+            'customdata': indices.map(idx => [changes['TRACT'][idx], dollars(layers['change'][idx]), layers['pct'][idx], dollars(layers['moe'][idx])]),
+        });
+        const result = {'year': changes[comparison]['year'], 'beyond': arrays(groups['beyond']), 'inside': arrays(groups['inside']),
+                        'missing': arrays(groups['missing'])};
+        result['zmax'] = abs_percentile([...result['beyond']['z'], ...result['inside']['z']]) || 1;
+        return result;
+    },
+
+    // Arrays of the income plot of a census tract (by GEO_ID), with one dollar factor per year
+    plot_arrays: async function({base, place, geo_id, demographic, factors}, timings) {
+        const series = (await cached(`${base}${place}_series.json`, fetch_json, timings))['SERIES'][geo_id];
+        if (series == undefined) {
+            return null;
+        }
+        const column = (col) => Float64Array.from(series[col], (value, idx) => Math.round((value ?? NaN) * factors[series['YEAR'][idx]]));
+        const margins = column(demographic.replace('_001E', '_001M'));
+        return {
+            'x': Float64Array.from(series['YEAR']),
+            'y': column(demographic),
+            'upper': column(`${demographic}_upper`),
+            'lower': column(`${demographic}_lower`),
+            'customdata': series['TRACT'].map((tract, idx) => [tract, nullable(margins[idx])]),
+        };
+    },
+};
+
+// 95th percentile of the absolute values (the range of a diverging color scale, robust to a few outliers)
+function abs_percentile(values, percentile = 0.95) {
+    const sorted = Float64Array.from(values, Math.abs).filter(value => !Number.isNaN(value)).sort();
+    return sorted.length ? sorted[Math.min(sorted.length - 1, Math.floor(percentile * sorted.length))] : 0;
+}
+
+// Buffers of the typed arrays in a result (and in its groups and frames), handed over to the main thread
+// instead of copied
+function transferables(result) {
+    const nested = value => value != null && typeof value === 'object' && !Array.isArray(value) && !ArrayBuffer.isView(value);
+    return Object.values(result ?? {}).flatMap(value => ArrayBuffer.isView(value) ? [value.buffer] :
+        (nested(value) ? transferables(value) : (Array.isArray(value) ? value.filter(nested).flatMap(transferables) : [])));
+}
+
+// Each result is posted with the timings of its request (see assets/telemetry.js): the download, size and
+// parsing of the files it loaded (nothing for files already loaded, or being loaded by an earlier request),
+// and the rest of the request as build_ms
+self.onmessage = async function(event) {
+    const {id, type, params} = event.data;
+    const start = performance.now();
+    const timings = {'fetch_ms': 0, 'bytes': 0, 'parse_ms': 0};
+    try {
+        const result = await handlers[type](params, timings);
+        timings['build_ms'] = Math.max(0, performance.now() - start - timings['fetch_ms'] - timings['parse_ms']);
+        self.postMessage({id, result, timings}, transferables(result));
+    } catch (error) {
+        self.postMessage({id, error: String(error)});
+    }
+};